@@ -1,10 +1,17 @@
-import os, sqlite3
-from flask import Flask, g, render_template, request, redirect, url_for, jsonify, abort
+import contextlib, functools, os, queue, re, threading
+import orjson
+from flask import Flask, Response, g, render_template, request, redirect, url_for, abort, stream_with_context
 from datetime import datetime
 from typing import Optional
 from zoneinfo import ZoneInfo
 import socket
 
+try:
+    # Bundles a current SQLite (better planner, FTS5, RETURNING) instead of the system library
+    import pysqlite3 as sqlite3
+except ImportError:
+    import sqlite3
+
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 IS_VERCEL = bool(os.environ.get('VERCEL') or os.environ.get('VERCEL_ENV') or os.environ.get('NOW_REGION'))
 
@@ -13,24 +20,42 @@ DEFAULT_DB_PATH = '/tmp/lifelink.db' if IS_VERCEL else os.path.join(BASE_DIR, 'l
 DB_PATH = os.environ.get('LIFELINK_DB', DEFAULT_DB_PATH)
 PORT = int(os.environ.get("PORT", "5000"))
 LOCAL_TZ = ZoneInfo(os.environ.get("LIFELINK_TZ", "America/Chicago"))
+UTC = ZoneInfo("UTC")
 
 app = Flask(__name__)
 
-# ---------- DB helpers ----------
+# ---------- Time helpers ----------
 
-def get_db():
-    db = getattr(g, "_db", None)
-    if db is None:
-        db = g._db = sqlite3.connect(DB_PATH, check_same_thread=False)
-        db.row_factory = sqlite3.Row
-    return db
+# Timestamps are immutable strings, so parsed/formatted results can be memoized safely
+@functools.lru_cache(maxsize=4096)
+def _parse_ts_cached(ts: str) -> datetime:
+    # SQLite CURRENT_TIMESTAMP uses "YYYY-MM-DD HH:MM:SS", which the C-level
+    # fromisoformat parses directly (much faster than strptime's format interpreter)
+    try:
+        dt = datetime.fromisoformat(ts)
+    except ValueError:
+        # Fallback for non-zero-padded values such as "2024-1-5 3:04:05"
+        dt = datetime.strptime(ts, "%Y-%m-%d %H:%M:%S")
+    return dt.replace(tzinfo=UTC)
 
 
-@app.teardown_appcontext
-def close_db(exc):
-    db = getattr(g, "_db", None)
-    if db is not None:
-        db.close()
+def parse_ts(ts: Optional[str]):
+    if not ts:
+        return None
+    return _parse_ts_cached(ts)
+
+
+@functools.lru_cache(maxsize=4096)
+def to_local_str(ts: Optional[str]):
+    dt = parse_ts(ts)
+    if not dt:
+        return ""
+    return dt.astimezone(LOCAL_TZ).strftime("%Y-%m-%d %H:%M %Z")
+
+
+# ---------- DB helpers ----------
+
+_SEEDED = False
 
 
 def seed_if_needed():
@@ -39,8 +64,17 @@ def seed_if_needed():
     Notes:
       - On Vercel, DB_PATH defaults to /tmp/lifelink.db so writes are allowed.
       - Seeding uses seed.sql shipped with the repo (read-only is fine).
+      - Only the first call per process touches the filesystem.
     """
-    if not os.path.exists(DB_PATH):
+    global _SEEDED
+    if _SEEDED:
+        return
+    # A single stat() decides it: an existing, non-empty file is already seeded
+    try:
+        seeded = os.stat(DB_PATH).st_size > 0
+    except FileNotFoundError:
+        seeded = False
+    if not seeded:
         os.makedirs(os.path.dirname(DB_PATH), exist_ok=True) if os.path.dirname(DB_PATH) else None
         conn = sqlite3.connect(DB_PATH)
         cur = conn.cursor()
@@ -49,11 +83,168 @@ def seed_if_needed():
             cur.executescript(f.read())
         conn.commit()
         conn.close()
+    _SEEDED = True
 
 
 seed_if_needed()
 
 
+def _connect():
+    # check_same_thread=False only because pooled connections move between request threads;
+    # a connection is never used by two requests at once.
+    db = sqlite3.connect(DB_PATH, check_same_thread=False, isolation_level=None, cached_statements=256)
+    db.row_factory = sqlite3.Row
+    db.executescript(
+        "PRAGMA journal_mode=WAL;"
+        "PRAGMA synchronous=NORMAL;"
+        "PRAGMA temp_store=MEMORY;"
+        "PRAGMA mmap_size=268435456;"
+        "PRAGMA cache_size=-65536;"
+        "PRAGMA foreign_keys=ON;"
+    )
+    # Lets queries project display-ready local timestamps instead of formatting per row in Python
+    db.create_function("to_local", 1, to_local_str, deterministic=True)
+    return db
+
+
+# Idle connections kept for reuse across requests instead of reconnecting each time.
+# Each request checks one out for its own exclusive use, so concurrent requests never
+# share a connection (or see each other's open transactions).
+_POOL_SIZE = 8
+_POOL = queue.LifoQueue(maxsize=_POOL_SIZE)
+
+
+def get_db():
+    db = getattr(g, "_db", None)
+    if db is None:
+        try:
+            db = _POOL.get_nowait()
+        except queue.Empty:
+            db = _connect()
+        g._db = db
+    return db
+
+
+@app.teardown_appcontext
+def close_db(exc):
+    db = g.pop("_db", None)
+    if db is None:
+        return
+    if db.in_transaction:
+        db.rollback()
+    try:
+        _POOL.put_nowait(db)
+    except queue.Full:
+        db.close()
+
+
+@contextlib.contextmanager
+def transaction(db=None):
+    """Run the block inside one write transaction on `db` (default: the request's connection).
+
+    Connections are in autocommit mode, so the transaction is opened explicitly with
+    BEGIN IMMEDIATE. It commits when the block exits normally (unless the block already
+    rolled back) and rolls back if it raises.
+    """
+    db = db or get_db()
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        yield db
+    except BaseException:
+        if db.in_transaction:
+            db.rollback()
+        raise
+    if db.in_transaction:
+        db.execute("COMMIT")
+
+
+def ensure_indexes(db):
+    """Create the indexes backing the portal/listing filters (idempotent, runs at startup).
+
+    Kept out of seed.sql so databases seeded before these existed pick them up too.
+    """
+    db.executescript(
+        """
+        CREATE INDEX IF NOT EXISTS idx_tr_driver_status
+            ON transport_requests(driver_id, status);
+        CREATE INDEX IF NOT EXISTS idx_tr_hospital_created
+            ON transport_requests(hospital, created_at DESC);
+        CREATE INDEX IF NOT EXISTS idx_tr_status_priority_created
+            ON transport_requests(status, priority_status, created_at)
+            WHERE driver_id IS NULL;
+        CREATE INDEX IF NOT EXISTS idx_tr_listing_id
+            ON transport_requests(listing_id);
+        CREATE INDEX IF NOT EXISTS idx_ol_hospital_name_created
+            ON organ_listings(hospital_name, created_at DESC);
+        CREATE INDEX IF NOT EXISTS idx_ol_avail_priority
+            ON organ_listings(availability_status, priority_status, created_at DESC);
+        CREATE INDEX IF NOT EXISTS idx_ol_organ_type_nocase
+            ON organ_listings(organ_type COLLATE NOCASE);
+        CREATE INDEX IF NOT EXISTS idx_ol_blood_type_nocase
+            ON organ_listings(blood_type COLLATE NOCASE);
+        CREATE INDEX IF NOT EXISTS idx_ol_created_id
+            ON organ_listings(created_at, id);
+        """
+    )
+
+
+# DDL for the listings search index, keyed by object name. The stored SQL is compared
+# against this on startup, so changing any statement here (e.g. the tokenizer) rebuilds it.
+# The tokenizer splits on '+'/'-' (so "Winston-Salem" is searchable as "salem"); blood
+# types are matched on the column directly instead, see organ_listings().
+_FTS_SCHEMA = {
+    "organ_listings_fts": """CREATE VIRTUAL TABLE organ_listings_fts USING fts5(
+        organ_type, blood_type, hospital_name, city, state,
+        content='organ_listings', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )""",
+    "organ_listings_fts_ai": """CREATE TRIGGER organ_listings_fts_ai AFTER INSERT ON organ_listings BEGIN
+        INSERT INTO organ_listings_fts(rowid, organ_type, blood_type, hospital_name, city, state)
+        VALUES (new.id, new.organ_type, new.blood_type, new.hospital_name, new.city, new.state);
+    END""",
+    "organ_listings_fts_ad": """CREATE TRIGGER organ_listings_fts_ad AFTER DELETE ON organ_listings BEGIN
+        INSERT INTO organ_listings_fts(organ_listings_fts, rowid, organ_type, blood_type, hospital_name, city, state)
+        VALUES ('delete', old.id, old.organ_type, old.blood_type, old.hospital_name, old.city, old.state);
+    END""",
+    # Only the indexed columns; availability flips in request_transport don't touch the index
+    "organ_listings_fts_au": """CREATE TRIGGER organ_listings_fts_au
+    AFTER UPDATE OF organ_type, blood_type, hospital_name, city, state ON organ_listings BEGIN
+        INSERT INTO organ_listings_fts(organ_listings_fts, rowid, organ_type, blood_type, hospital_name, city, state)
+        VALUES ('delete', old.id, old.organ_type, old.blood_type, old.hospital_name, old.city, old.state);
+        INSERT INTO organ_listings_fts(rowid, organ_type, blood_type, hospital_name, city, state)
+        VALUES (new.id, new.organ_type, new.blood_type, new.hospital_name, new.city, new.state);
+    END""",
+}
+
+
+def ensure_search_index(db):
+    """Maintain an FTS5 index over the searchable organ_listings columns.
+
+    The table is external-content (rows live in organ_listings) and kept in sync by
+    triggers. If any of its objects is missing or differs from _FTS_SCHEMA, all of them
+    are dropped, recreated and the index is rebuilt from organ_listings.
+    """
+    with transaction(db):
+        current = dict(db.execute(
+            f"SELECT name, sql FROM sqlite_master WHERE name IN ({','.join('?' * len(_FTS_SCHEMA))})",
+            tuple(_FTS_SCHEMA),
+        ).fetchall())
+        if current != _FTS_SCHEMA:
+            for name in _FTS_SCHEMA:
+                if name != "organ_listings_fts":
+                    db.execute(f"DROP TRIGGER IF EXISTS {name}")
+            db.execute("DROP TABLE IF EXISTS organ_listings_fts")
+            for sql in _FTS_SCHEMA.values():
+                db.execute(sql)
+            db.execute("INSERT INTO organ_listings_fts(organ_listings_fts) VALUES ('rebuild')")
+
+
+_startup_db = _connect()
+ensure_indexes(_startup_db)
+ensure_search_index(_startup_db)
+_POOL.put_nowait(_startup_db)
+
+
 def query(sql, args=(), one=False):
     cur = get_db().execute(sql, args)
     rv = cur.fetchall()
@@ -64,34 +255,73 @@ def query(sql, args=(), one=False):
 def execute(sql, args=()):
     db = get_db()
     cur = db.execute(sql, args)
-    db.commit()
     return cur.lastrowid
 
 
-@app.context_processor
-def inject_now():
-    return {"now": datetime.utcnow()}
+def execute_returning(sql, args=()):
+    """Run a write with a RETURNING clause and return its first row (or None)."""
+    db = get_db()
+    cur = db.execute(sql, args)
+    row = cur.fetchone()
+    cur.close()
+    return row
 
 
-# ---------- Time helpers ----------
+def executemany_tx(statements):
+    """Run (sql, args) pairs in a single transaction, committing once.
 
-def parse_ts(ts: Optional[str]):
-    if not ts:
-        return None
-    # SQLite CURRENT_TIMESTAMP uses "YYYY-MM-DD HH:MM:SS"
-    try:
-        dt = datetime.strptime(ts, "%Y-%m-%d %H:%M:%S")
-    except ValueError:
-        # Fallback to fromisoformat
-        dt = datetime.fromisoformat(ts)
-    return dt.replace(tzinfo=ZoneInfo("UTC"))
+    It runs on the request's own pooled connection, so other requests see none of it
+    until COMMIT, and nothing at all after a ROLLBACK.
 
+    Returns cursor.lastrowid after each statement; that value is only meaningful for
+    INSERTs (after an UPDATE it is still the previous INSERT's rowid).
+    """
+    with transaction() as db:
+        return [db.execute(sql, args).lastrowid for sql, args in statements]
 
-def to_local_str(ts: Optional[str]):
-    dt = parse_ts(ts)
-    if not dt:
-        return ""
-    return dt.astimezone(LOCAL_TZ).strftime("%Y-%m-%d %H:%M %Z")
+
+# Hospitals and drivers change only through hospital_registration / apply_driver, so their
+# full lists are cached in-process and dropped whenever one of those routes writes.
+# Filling (query + store) and clearing both hold _CACHE_LOCK; a clear issued after a
+# committed INSERT therefore either precedes a fill that sees the new row or discards it.
+# The cache is per process and assumes a single process per database file: on Vercel each
+# instance has its own /tmp copy, but locally several workers (e.g. gunicorn -w 4) share
+# lifelink.db and a registration in one worker is not seen by the others' caches.
+_HOSPITAL_CACHE = {"rows": None}
+_DRIVER_CACHE = {"rows": None}
+_CACHE_LOCK = threading.Lock()
+
+
+def _cached_rows(cache, sql):
+    rows = cache["rows"]
+    if rows is not None:
+        return rows
+    with _CACHE_LOCK:
+        if cache["rows"] is None:
+            cache["rows"] = query(sql)
+        return cache["rows"]
+
+
+def invalidate_cache(cache):
+    with _CACHE_LOCK:
+        cache["rows"] = None
+
+
+def all_hospitals():
+    return _cached_rows(_HOSPITAL_CACHE, "SELECT * FROM hospitals ORDER BY name ASC")
+
+
+def all_drivers():
+    return _cached_rows(_DRIVER_CACHE, "SELECT * FROM drivers ORDER BY first_name, last_name")
+
+
+@app.context_processor
+def inject_now():
+    # Computed once per request and reused by every template rendered during it
+    now = getattr(g, "_now", None)
+    if now is None:
+        now = g._now = datetime.now(UTC)
+    return {"now": now}
 
 
 # ---------- Basic pages ----------
@@ -108,51 +338,82 @@ def contact():
 
 # ---------- Customer side: browse + place delivery request ----------
 
+# Blood types like "AB+" or "o-"; the FTS tokenizer drops the sign, so these are matched exactly
+BLOOD_TYPE_RE = re.compile(r"^(a|b|ab|o)[+-]$", re.IGNORECASE)
+
+
+def fts_prefix_query(words) -> str:
+    # Quote each word so user input can't inject FTS5 operators; trailing * makes it a prefix match
+    return " ".join('"' + word.replace('"', '""') + '"*' for word in words)
+
+
 @app.route("/organ-listings")
 def organ_listings():
     q = request.args.get("q", "").strip().lower()
     typ = request.args.get("type", "All")
     availability = request.args.get("availability", "All")
 
-    sql = "SELECT * FROM organ_listings WHERE 1=1"
+    words = q.split()
+    blood_types = [w for w in words if BLOOD_TYPE_RE.match(w)]
+    text_words = [w for w in words if not BLOOD_TYPE_RE.match(w)]
+
+    sql = "SELECT ol.* FROM organ_listings ol"
     args = []
 
-    if typ and typ != "All":
-        sql += " AND lower(organ_type) = ?"
-        args.append(typ.lower())
+    if text_words:
+        sql += " JOIN organ_listings_fts ON organ_listings_fts.rowid = ol.id"
+    sql += " WHERE 1=1"
 
+    # Cheap equality filters first; the text search is always the last term
     if availability == "Available":
-        sql += " AND availability_status = 'Available'"
+        sql += " AND ol.availability_status = 'Available'"
     elif availability == "Unavailable":
-        sql += " AND availability_status = 'Unavailable'"
-
-    if q:
-        like = f"%{q}%"
-        sql += (
-            " AND ("
-            "   lower(organ_type) LIKE ?"
-            "   OR lower(blood_type) LIKE ?"
-            "   OR lower(hospital_name) LIKE ?"
-            "   OR lower(city) LIKE ?"
-            "   OR lower(state) LIKE ?"
-            ")"
-        )
-        args.extend([like, like, like, like, like])
+        sql += " AND ol.availability_status = 'Unavailable'"
+
+    if typ and typ != "All":
+        # COLLATE NOCASE instead of lower(): same match, but idx_ol_organ_type_nocase stays usable
+        sql += " AND ol.organ_type = ? COLLATE NOCASE"
+        args.append(typ)
+
+    for blood_type in blood_types:
+        sql += " AND ol.blood_type = ? COLLATE NOCASE"
+        args.append(blood_type)
+
+    if text_words:
+        sql += " AND organ_listings_fts MATCH ?"
+        args.append(fts_prefix_query(text_words))
 
     # Order by priority (Emergency > Critical > Urgent > Normal) then newest first
     sql += (
-        " ORDER BY CASE priority_status "
+        " ORDER BY CASE ol.priority_status "
         "   WHEN 'Emergency' THEN 1 "
         "   WHEN 'Critical' THEN 2 "
         "   WHEN 'Urgent' THEN 3 "
         "   ELSE 4 "
-        " END, created_at DESC"
+        " END, ol.created_at DESC"
     )
 
     organs = query(sql, args)
     return render_template("organ_listings.html", organs=organs)
 
 
+_SQL_RESERVE_LISTING = """
+UPDATE organ_listings
+SET availability_status = 'Unavailable'
+WHERE id = ?
+  AND availability_status = 'Available'
+RETURNING id
+"""
+
+_SQL_INSERT_TRANSPORT_REQUEST = """
+INSERT INTO transport_requests(
+    listing_id,hospital,organ_type,origin,destination,contact_phone,notes,
+    priority_status,status,driver_id
+)
+VALUES(?,?,?,?,?,?,?,?,?,NULL)
+"""
+
+
 @app.route("/request-transport/<int:listing_id>", methods=["GET", "POST"])
 def request_transport(listing_id: int):
     listing = query("SELECT * FROM organ_listings WHERE id = ?", (listing_id,), one=True)
@@ -166,7 +427,7 @@ def request_transport(listing_id: int):
             listing=listing,
         ), 400
 
-    hospitals = query("SELECT * FROM hospitals ORDER BY name ASC")
+    hospitals = all_hospitals()
 
     if request.method == "POST":
         d = request.form
@@ -189,32 +450,33 @@ def request_transport(listing_id: int):
 
         origin = f"{listing['hospital_name']} ({listing['city']}, {listing['state']})"
 
-        order_id = execute(
-            """
-            INSERT INTO transport_requests(
-                listing_id,hospital,organ_type,origin,destination,contact_phone,notes,
-                priority_status,status,driver_id
-            )
-            VALUES(?,?,?,?,?,?,?,?,?,NULL)
-            """,
-            (
-                listing["id"],
-                hospital_row["name"],
-                listing["organ_type"],
-                origin,
-                destination,
-                contact_phone,
-                notes,
-                listing["priority_status"],
-                "Requested",
-            ),
-        )
-
-        # Immediately mark listing as unavailable
-        execute(
-            "UPDATE organ_listings SET availability_status = 'Unavailable' WHERE id = ?",
-            (listing["id"],),
-        )
+        # Reserve the listing first: the guarded UPDATE lets only one concurrent request
+        # through, and the order is inserted in that same transaction.
+        with transaction() as db:
+            cur = db.execute(_SQL_RESERVE_LISTING, (listing["id"],))
+            reserved = cur.fetchone()
+            cur.close()
+            if not reserved:
+                db.rollback()
+                return render_template(
+                    "request_transport_unavailable.html",
+                    listing=listing,
+                ), 400
+
+            order_id = db.execute(
+                _SQL_INSERT_TRANSPORT_REQUEST,
+                (
+                    listing["id"],
+                    hospital_row["name"],
+                    listing["organ_type"],
+                    origin,
+                    destination,
+                    contact_phone,
+                    notes,
+                    listing["priority_status"],
+                    "Requested",
+                ),
+            ).lastrowid
 
         return redirect(url_for("order_confirmation", order_id=order_id))
 
@@ -223,109 +485,97 @@ def request_transport(listing_id: int):
 
 # ---------- Order confirmation ----------
 
+_SQL_ORDER_CONFIRM = """
+SELECT tr.*,
+       ol.organ_type AS listing_organ_type,
+       ol.blood_type AS listing_blood_type,
+       ol.hospital_name AS source_hospital,
+       ol.city AS source_city,
+       ol.state AS source_state,
+       ol.priority_status AS listing_priority_status,
+       d.first_name || ' ' || d.last_name AS driver_name,
+       d.phone AS driver_phone,
+       to_local(tr.created_at) AS created_local,
+       to_local(tr.updated_at) AS updated_local
+FROM transport_requests tr
+LEFT JOIN organ_listings ol ON tr.listing_id = ol.id
+LEFT JOIN drivers d ON tr.driver_id = d.id
+WHERE tr.id = ?
+"""
+
+
 @app.route("/order-confirmation/<int:order_id>")
 def order_confirmation(order_id: int):
-    order = query(
-        """
-        SELECT tr.*,
-               ol.organ_type AS listing_organ_type,
-               ol.blood_type AS listing_blood_type,
-               ol.hospital_name AS source_hospital,
-               ol.city AS source_city,
-               ol.state AS source_state,
-               ol.priority_status AS listing_priority_status,
-               d.first_name || ' ' || d.last_name AS driver_name,
-               d.phone AS driver_phone
-        FROM transport_requests tr
-        LEFT JOIN organ_listings ol ON tr.listing_id = ol.id
-        LEFT JOIN drivers d ON tr.driver_id = d.id
-        WHERE tr.id = ?
-        """,
-        (order_id,),
-        one=True,
-    )
+    order = query(_SQL_ORDER_CONFIRM, (order_id,), one=True)
     if not order:
         abort(404, "Order not found")
 
-    created_local = to_local_str(order["created_at"])
-    updated_local = to_local_str(order["updated_at"])
-
     return render_template(
         "order_confirmation.html",
         order=order,
-        created_local=created_local,
-        updated_local=updated_local,
+        created_local=order["created_local"],
+        updated_local=order["updated_local"],
     )
 
 
 # ---------- Hospital side: inbound / outbound views ----------
 
+_SQL_HOSPITAL_ORDERS = """
+SELECT 'out' AS dir,
+       tr.*,
+       ol.organ_type AS listing_organ_type,
+       ol.blood_type AS listing_blood_type,
+       ol.hospital_name AS source_hospital,
+       ol.city AS source_city,
+       ol.state AS source_state
+FROM transport_requests tr
+LEFT JOIN organ_listings ol ON tr.listing_id = ol.id
+WHERE tr.hospital = ?1
+UNION ALL
+SELECT 'in' AS dir,
+       tr.*,
+       ol.organ_type AS listing_organ_type,
+       ol.blood_type AS listing_blood_type,
+       ol.hospital_name AS source_hospital,
+       ol.city AS source_city,
+       ol.state AS source_state
+FROM transport_requests tr
+LEFT JOIN organ_listings ol ON tr.listing_id = ol.id
+WHERE ol.hospital_name = ?1
+ORDER BY created_at DESC
+"""
+
+_SQL_HOSPITAL_LISTINGS = """
+SELECT * FROM organ_listings
+WHERE hospital_name = ?
+ORDER BY created_at DESC
+"""
+
+
 @app.route("/for_hospitals")
 def for_hospitals():
-    hospitals = query("SELECT * FROM hospitals ORDER BY name ASC")
-    selected_id = request.args.get("hospital_id")
+    hospitals = all_hospitals()
+    selected_id = request.args.get("hospital_id", type=int)
     selected_hospital = None
 
     if hospitals:
-        if selected_id:
-            selected_hospital = query(
-                "SELECT * FROM hospitals WHERE id = ?",
-                (selected_id,),
-                one=True,
-            )
-        if not selected_hospital:
-            selected_hospital = hospitals[0]
+        # Pick the selection out of the list we already have instead of a second lookup
+        selected_hospital = next((h for h in hospitals if h["id"] == selected_id), hospitals[0])
 
     outbound = []
     inbound = []
 
     if selected_hospital:
-        hname = selected_hospital["name"]
-
         # Outbound: requests originating from this hospital
-        outbound = query(
-            """
-            SELECT tr.*,
-                   ol.organ_type AS listing_organ_type,
-                   ol.blood_type AS listing_blood_type,
-                   ol.hospital_name AS source_hospital,
-                   ol.city AS source_city,
-                   ol.state AS source_state
-            FROM transport_requests tr
-            LEFT JOIN organ_listings ol ON tr.listing_id = ol.id
-            WHERE tr.hospital = ?
-            ORDER BY tr.created_at DESC
-            """,
-            (hname,),
-        )
-
         # Inbound: requests targeting organs owned by this hospital
-        inbound = query(
-            """
-            SELECT tr.*,
-                   ol.organ_type AS listing_organ_type,
-                   ol.blood_type AS listing_blood_type,
-                   ol.hospital_name AS source_hospital,
-                   ol.city AS source_city,
-                   ol.state AS source_state
-            FROM transport_requests tr
-            LEFT JOIN organ_listings ol ON tr.listing_id = ol.id
-            WHERE ol.hospital_name = ?
-            ORDER BY tr.created_at DESC
-            """,
-            (hname,),
-        )
+        # Both come back in one round trip, tagged by direction.
+        rows = query(_SQL_HOSPITAL_ORDERS, (selected_hospital["name"],))
+        outbound = [r for r in rows if r["dir"] == "out"]
+        inbound = [r for r in rows if r["dir"] == "in"]
 
     listings = []
     if selected_hospital:
-        listings = query(
-            """
-            SELECT * FROM organ_listings
-            WHERE hospital_name = ?
-            ORDER BY created_at DESC
-            """,
-            (selected_hospital["name"],),
-        )
+        listings = query(_SQL_HOSPITAL_LISTINGS, (selected_hospital["name"],))
 
     return render_template(
         "for_hospitals.html",
@@ -345,6 +595,7 @@ def hospital_registration():
             "INSERT INTO hospitals(name,city,state,email) VALUES(?,?,?,?)",
             (d["name"], d["city"], d["state"], d["email"]),
         )
+        invalidate_cache(_HOSPITAL_CACHE)
         return redirect(url_for("for_hospitals"))
     return render_template("hospital_registration.html")
 
@@ -357,10 +608,19 @@ def hospital_login():
     return render_template("hospital_login.html")
 
 
+_SQL_INSERT_LISTING = """
+INSERT INTO organ_listings(
+    hospital_id,hospital_name,organ_type,blood_type,age,weight_kg,
+    priority_status,availability_status,city,state
+)
+VALUES(?,?,?,?,?,?,?,?,?,?)
+"""
+
+
 # Allow hospital users to upload new organs for their facility
 @app.route("/new-listing", methods=["GET", "POST"])
 def new_listing():
-    hospitals = query("SELECT * FROM hospitals ORDER BY name ASC")
+    hospitals = all_hospitals()
     if request.method == "POST":
         d = request.form
         hospital_id = d.get("hospital_id")
@@ -375,13 +635,7 @@ def new_listing():
         availability = d.get("availability_status", "Available")
 
         execute(
-            """
-            INSERT INTO organ_listings(
-                hospital_id,hospital_name,organ_type,blood_type,age,weight_kg,
-                priority_status,availability_status,city,state
-            )
-            VALUES(?,?,?,?,?,?,?,?,?,?)
-            """,
+            _SQL_INSERT_LISTING,
             (
                 hrow["id"],
                 hrow["name"],
@@ -402,18 +656,21 @@ def new_listing():
 
 # ---------- Emergency transport (simple form) ----------
 
+_SQL_INSERT_EMERGENCY_REQUEST = """
+INSERT INTO transport_requests(
+    listing_id,hospital,organ_type,origin,destination,contact_phone,notes,
+    priority_status,status,driver_id
+)
+VALUES(NULL,?,?,?,?,?,?,?,'Emergency','Requested',NULL)
+"""
+
+
 @app.route("/emergency-transport", methods=["GET", "POST"])
 def emergency_transport():
     if request.method == "POST":
         d = request.form
         execute(
-            """
-            INSERT INTO transport_requests(
-                listing_id,hospital,organ_type,origin,destination,contact_phone,notes,
-                priority_status,status,driver_id
-            )
-            VALUES(NULL,?,?,?,?,?,?,?,'Emergency','Requested',NULL)
-            """,
+            _SQL_INSERT_EMERGENCY_REQUEST,
             (
                 d["hospital"],
                 d["organ_type"],
@@ -434,32 +691,75 @@ def demo_hospital():
 
 # ---------- Driver portal / admin for delivery ops ----------
 
+_SQL_DRIVER_ACTIVE_COUNT = """
+SELECT COUNT(*) AS c
+FROM transport_requests
+WHERE driver_id = ?
+  AND status IN ('Assigned','En-route')
+"""
+
+
 def driver_has_active_order(driver_id: int) -> bool:
-    row = query(
-        """
-        SELECT COUNT(*) AS c
-        FROM transport_requests
-        WHERE driver_id = ?
-          AND status IN ('Assigned','En-route')
-        """,
-        (driver_id,),
-        one=True,
-    )
+    row = query(_SQL_DRIVER_ACTIVE_COUNT, (driver_id,), one=True)
     return (row["c"] if row else 0) > 0
 
 
+# The driver's in-flight order and their last 20 deliveries in one pass: rows are
+# bucketed by status and ranked within each bucket by a window function.
+_SQL_DRIVER_ORDERS = """
+WITH d AS (
+    SELECT tr.*,
+           ol.organ_type AS listing_organ_type,
+           ol.blood_type AS listing_blood_type,
+           ol.hospital_name AS source_hospital,
+           to_local(tr.updated_at) AS updated_local,
+           CASE WHEN tr.status = 'Delivered' THEN 'done' ELSE 'current' END AS bucket
+    FROM transport_requests tr
+    LEFT JOIN organ_listings ol ON tr.listing_id = ol.id
+    WHERE tr.driver_id = ?
+      AND tr.status IN ('Assigned','En-route','Delivered')
+),
+ranked AS (
+    SELECT d.*,
+           ROW_NUMBER() OVER (
+               PARTITION BY bucket
+               ORDER BY CASE bucket WHEN 'current' THEN created_at ELSE updated_at END DESC
+           ) AS rn
+    FROM d
+)
+SELECT * FROM ranked
+WHERE (bucket = 'current' AND rn = 1)
+   OR (bucket = 'done' AND rn <= 20)
+ORDER BY bucket, rn
+"""
+
+_SQL_DRIVER_AVAILABLE = """
+SELECT tr.*,
+       ol.organ_type AS listing_organ_type,
+       ol.blood_type AS listing_blood_type,
+       ol.hospital_name AS source_hospital,
+       to_local(tr.created_at) AS created_local
+FROM transport_requests tr
+LEFT JOIN organ_listings ol ON tr.listing_id = ol.id
+WHERE tr.status = 'Requested'
+  AND (tr.driver_id IS NULL)
+ORDER BY CASE tr.priority_status
+           WHEN 'Emergency' THEN 1
+           WHEN 'Urgent' THEN 2
+           WHEN 'Critical' THEN 3
+           ELSE 4
+         END,
+         tr.created_at ASC
+"""
+
+
 @app.route("/driver-portal")
 def driver_portal():
-    drivers = query("SELECT * FROM drivers ORDER BY first_name, last_name")
+    drivers = all_drivers()
     selected_id = request.args.get("driver_id", type=int)
     selected_driver = None
     if drivers:
-        if selected_id:
-            selected_driver = query(
-                "SELECT * FROM drivers WHERE id = ?", (selected_id,), one=True
-            )
-        if not selected_driver:
-            selected_driver = drivers[0]
+        selected_driver = next((d for d in drivers if d["id"] == selected_id), drivers[0])
 
     current_order = None
     completed_orders = []
@@ -467,59 +767,12 @@ def driver_portal():
 
     if selected_driver:
         did = selected_driver["id"]
-        current_order = query(
-            """
-            SELECT tr.*,
-                   ol.organ_type AS listing_organ_type,
-                   ol.blood_type AS listing_blood_type,
-                   ol.hospital_name AS source_hospital
-            FROM transport_requests tr
-            LEFT JOIN organ_listings ol ON tr.listing_id = ol.id
-            WHERE tr.driver_id = ?
-              AND tr.status IN ('Assigned','En-route')
-            ORDER BY tr.created_at DESC
-            LIMIT 1
-            """,
-            (did,),
-            one=True,
-        )
-
-        completed_orders = query(
-            """
-            SELECT tr.*,
-                   ol.organ_type AS listing_organ_type,
-                   ol.blood_type AS listing_blood_type,
-                   ol.hospital_name AS source_hospital
-            FROM transport_requests tr
-            LEFT JOIN organ_listings ol ON tr.listing_id = ol.id
-            WHERE tr.driver_id = ?
-              AND tr.status = 'Delivered'
-            ORDER BY tr.updated_at DESC
-            LIMIT 20
-            """,
-            (did,),
-        )
+        rows = query(_SQL_DRIVER_ORDERS, (did,))
+        current_order = next((r for r in rows if r["bucket"] == "current"), None)
+        completed_orders = [r for r in rows if r["bucket"] == "done"]
 
     # Available orders (unassigned, status Requested), sorted by priority then request time
-    available_orders = query(
-        """
-        SELECT tr.*,
-               ol.organ_type AS listing_organ_type,
-               ol.blood_type AS listing_blood_type,
-               ol.hospital_name AS source_hospital
-        FROM transport_requests tr
-        LEFT JOIN organ_listings ol ON tr.listing_id = ol.id
-        WHERE tr.status = 'Requested'
-          AND (tr.driver_id IS NULL)
-        ORDER BY CASE tr.priority_status
-                   WHEN 'Emergency' THEN 1
-                   WHEN 'Urgent' THEN 2
-                   WHEN 'Critical' THEN 3
-                   ELSE 4
-                 END,
-                 tr.created_at ASC
-        """
-    )
+    available_orders = query(_SQL_DRIVER_AVAILABLE)
 
     return render_template(
         "driver_portal.html",
@@ -528,56 +781,99 @@ def driver_portal():
         current_order=current_order,
         completed_orders=completed_orders,
         available_orders=available_orders,
-        to_local_str=to_local_str,
     )
 
 
+_SQL_INSERT_DRIVER_APPLICATION = """
+INSERT INTO driver_applications(first_name,last_name,email,phone,cdl)
+VALUES(?,?,?,?,?)
+"""
+
+_SQL_INSERT_DRIVER = """
+INSERT INTO drivers(first_name,last_name,email,phone,cdl)
+VALUES(?,?,?,?,?)
+"""
+
+
 @app.route("/apply-driver", methods=["POST"])
 def apply_driver():
     d = request.form
-    # Store application for admin review
-    execute(
-        """
-        INSERT INTO driver_applications(first_name,last_name,email,phone,cdl)
-        VALUES(?,?,?,?,?)
-        """,
-        (d["first_name"], d["last_name"], d["email"], d["phone"], d["cdl"]),
-    )
-    # Also register as a driver so they appear in the dropdown immediately
-    execute(
-        """
-        INSERT INTO drivers(first_name,last_name,email,phone,cdl)
-        VALUES(?,?,?,?,?)
-        """,
-        (d["first_name"], d["last_name"], d["email"], d["phone"], d["cdl"]),
-    )
+    applicant = (d["first_name"], d["last_name"], d["email"], d["phone"], d["cdl"])
+    executemany_tx([
+        # Store application for admin review
+        (
+            _SQL_INSERT_DRIVER_APPLICATION,
+            applicant,
+        ),
+        # Also register as a driver so they appear in the dropdown immediately
+        (
+            _SQL_INSERT_DRIVER,
+            applicant,
+        ),
+    ])
+    invalidate_cache(_DRIVER_CACHE)
     return redirect(url_for("driver_portal"))
 
 
+_SQL_DRIVER_CLAIM = """
+UPDATE transport_requests
+SET driver_id = ?1, status = 'Assigned', updated_at = CURRENT_TIMESTAMP
+WHERE id = ?2
+  AND status = 'Requested'
+  AND driver_id IS NULL
+  AND NOT EXISTS (
+      SELECT 1 FROM transport_requests
+      WHERE driver_id = ?1
+        AND status IN ('Assigned','En-route')
+  )
+RETURNING id
+"""
+
+
 @app.route("/driver-claim/<int:order_id>", methods=["POST"])
 def driver_claim(order_id: int):
     driver_id = request.form.get("driver_id", type=int)
     if not driver_id:
         return "Driver required", 400
 
-    if driver_has_active_order(driver_id):
-        return "Driver already has an active order", 400
-
-    order = query("SELECT * FROM transport_requests WHERE id = ?", (order_id,), one=True)
-    if not order or order["status"] != "Requested":
+    # Availability and the one-active-order rule are checked in the UPDATE itself,
+    # so two drivers racing for the same order can't both win.
+    claimed = execute_returning(_SQL_DRIVER_CLAIM, (driver_id, order_id))
+    if not claimed:
+        if driver_has_active_order(driver_id):
+            return "Driver already has an active order", 400
         return "Order is no longer available", 400
 
-    execute(
-        """
-        UPDATE transport_requests
-        SET driver_id = ?, status = 'Assigned', updated_at = CURRENT_TIMESTAMP
-        WHERE id = ?
-        """,
-        (driver_id, order_id),
-    )
     return redirect(url_for("driver_portal", driver_id=driver_id))
 
 
+_SQL_ORDER_REQUEUE = """
+UPDATE transport_requests
+SET status = ?, driver_id = NULL, updated_at = CURRENT_TIMESTAMP
+WHERE id = ?
+  AND status != 'Delivered'
+RETURNING id
+"""
+
+_SQL_ORDER_SET_STATUS = """
+UPDATE transport_requests
+SET status = ?, updated_at = CURRENT_TIMESTAMP
+WHERE id = ?
+  AND status != 'Delivered'
+RETURNING id
+"""
+
+
+def _order_not_updatable(order_id: int):
+    # Error response for an order the status UPDATE can't touch: missing first, then delivered
+    order = query("SELECT status FROM transport_requests WHERE id = ?", (order_id,), one=True)
+    if not order:
+        return "Order not found", 404
+    if order["status"] == "Delivered":
+        return "Delivered orders cannot be modified", 400
+    return None
+
+
 @app.route("/driver-update-status/<int:order_id>", methods=["POST"])
 def driver_update_status(order_id: int):
     driver_id = request.form.get("driver_id", type=int)
@@ -586,38 +882,21 @@ def driver_update_status(order_id: int):
     if not driver_id or not new_status:
         return "Driver and status are required", 400
 
-    order = query("SELECT * FROM transport_requests WHERE id = ?", (order_id,), one=True)
-    if not order:
-        return "Order not found", 404
-
-    # Prevent changes once delivered
-    if order["status"] == "Delivered":
-        return "Delivered orders cannot be modified", 400
-
     # Only allow reverting Assigned -> Requested, or progressing along the flow
     allowed_statuses = {"Requested", "Assigned", "En-route", "Delivered"}
     if new_status not in allowed_statuses:
-        return "Invalid status", 400
+        # Keep the original precedence: a missing or delivered order is reported before a bad status
+        return _order_not_updatable(order_id) or ("Invalid status", 400)
 
     # If reverting to Requested, clear driver assignment
     if new_status == "Requested":
-        execute(
-            """
-            UPDATE transport_requests
-            SET status = ?, driver_id = NULL, updated_at = CURRENT_TIMESTAMP
-            WHERE id = ?
-            """,
-            (new_status, order_id),
-        )
+        updated = execute_returning(_SQL_ORDER_REQUEUE, (new_status, order_id))
     else:
-        execute(
-            """
-            UPDATE transport_requests
-            SET status = ?, updated_at = CURRENT_TIMESTAMP
-            WHERE id = ?
-            """,
-            (new_status, order_id),
-        )
+        updated = execute_returning(_SQL_ORDER_SET_STATUS, (new_status, order_id))
+
+    # Prevent changes once delivered (enforced by the WHERE clause above)
+    if not updated:
+        return _order_not_updatable(order_id) or ("Delivered orders cannot be modified", 400)
 
     return redirect(url_for("driver_portal", driver_id=driver_id))
 
@@ -631,28 +910,75 @@ def reports():
 
 
 def _find_free_port(preferred):
-    try_ports = list(range(preferred, preferred + 20))
-    for p in try_ports:
+    # Try the preferred port once, otherwise let the OS assign a free one
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    try:
         try:
-            s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            s.bind(("0.0.0.0", p))
-            s.close()
-            return p
+            s.bind(("0.0.0.0", preferred))
+            return preferred
         except OSError:
-            continue
-    # Let OS assign a random free port as a last resort
-    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    s.bind(("0.0.0.0", 0))
-    port = s.getsockname()[1]
-    s.close()
-    return port
+            s.bind(("0.0.0.0", 0))
+            return s.getsockname()[1]
+    finally:
+        s.close()
 
 # ---------- API ----------
 
+API_PAGE_SIZE = 100
+API_MAX_PAGE_SIZE = 1000
+
+_SQL_API_ORGANS_FIRST = """
+SELECT * FROM organ_listings
+ORDER BY created_at DESC, id DESC
+LIMIT ?
+"""
+
+_SQL_API_ORGANS_AFTER = """
+SELECT * FROM organ_listings
+WHERE (created_at, id) < (?, ?)
+ORDER BY created_at DESC, id DESC
+LIMIT ?
+"""
+
+
 @app.route("/api/organs")
 def api_organs():
-    rows = query("SELECT * FROM organ_listings ORDER BY created_at DESC")
-    return jsonify([dict(r) for r in rows])
+    """Newest-first page of organ listings as a JSON array.
+
+    Pass ?limit=N (default 100) and ?after_id=<id of the last row seen> to fetch the next page.
+    """
+    limit = request.args.get("limit", API_PAGE_SIZE, type=int)
+    limit = max(1, min(limit, API_MAX_PAGE_SIZE))
+
+    if "after_id" not in request.args:
+        cur = get_db().execute(_SQL_API_ORGANS_FIRST, (limit,))
+    else:
+        after_id = request.args.get("after_id", type=int)
+        anchor = None
+        if after_id is not None:
+            anchor = query("SELECT created_at, id FROM organ_listings WHERE id = ?", (after_id,), one=True)
+        if not anchor:
+            return "Unknown after_id", 400
+        # Keyset pagination: continue strictly after the (created_at, id) of the anchor row
+        cur = get_db().execute(_SQL_API_ORGANS_AFTER, (anchor["created_at"], anchor["id"], limit))
+    # Read column names once rather than calling Row.keys() for every row
+    cols = tuple(c[0] for c in cur.description)
+
+    def generate():
+        # Stream rows straight off the cursor; stream_with_context keeps the request context (and
+        # with it the pooled connection) alive until the generator is exhausted or closed
+        try:
+            yield b"["
+            for n, r in enumerate(cur):
+                if n:
+                    yield b","
+                yield orjson.dumps(dict(zip(cols, r)))
+            yield b"]"
+        finally:
+            cur.close()
+
+    return Response(stream_with_context(generate()), mimetype="application/json")
 
 
 if __name__ == "__main__":